@@ -2,11 +2,15 @@
 
 
 # InvenTree API version
-INVENTREE_API_VERSION = 127
+INVENTREE_API_VERSION = 128
 
 """
 Increment this API version number whenever there is a significant change to the API that any clients need to know about
 
+v128 -> 2026-10-15
+    - Adds "async" query parameter to the label print endpoints (returns a 202 response, with a reference to the output)
+    - Adds /api/label/output/<output>/ endpoint, for retrieving a label PDF file rendered by the background worker
+
 v127 -> 2023-06-24 : https://github.com/inventree/InvenTree/pull/5094
     - Enhancements for the PartParameter API endpoints
 
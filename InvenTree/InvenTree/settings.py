@@ -683,6 +683,12 @@ Q_CLUSTER = {
     'sync': False,
 }
 
+# Number of worker processes used to render labels in parallel (1 = render in the web server process)
+LABEL_RENDER_WORKERS = int(get_setting('INVENTREE_LABEL_WORKERS', 'label.workers', 1))
+
+# Cache rendered label PDF data (by default, only if a shared cache server is configured)
+LABEL_PDF_CACHE = get_boolean_setting('INVENTREE_LABEL_CACHE', 'label.cache', bool(cache_host))
+
 # Configure django-q sentry integration
 if SENTRY_ENABLED and SENTRY_DSN:
     Q_CLUSTER['error_reporter'] = {
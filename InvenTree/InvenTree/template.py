@@ -8,13 +8,27 @@ from django.template.loaders.cached import Loader as CachedLoader
 
 
 class InvenTreeTemplateLoader(CachedLoader):
-    """Custom template loader which bypasses cache for PDF export"""
+    """Custom template loader which revalidates cached templates for PDF export"""
+
+    def __init__(self, engine, loaders):
+        """Initialize the loader, and the record of template file modification times"""
+        super().__init__(engine, loaders)
+
+        self.template_mtimes = {}
+
+    def reset(self):
+        """Reset the template cache, and the record of template file modification times"""
+        super().reset()
+
+        self.template_mtimes.clear()
 
     def get_template(self, template_name, skip=None):
         """Return a template object for the given template name.
 
-        Any custom report or label templates will be forced to reload (without cache).
-        This ensures that generated PDF reports / labels are always up-to-date.
+        Any custom report or label templates are checked against the modification time of the template file,
+        and reloaded if the file has changed since it was cached.
+        This ensures that generated PDF reports / labels are always up-to-date,
+        without re-parsing the template for every label or report which is printed.
         """
 
         # List of template patterns to skip cache for
@@ -29,8 +43,21 @@ class InvenTreeTemplateLoader(CachedLoader):
 
         template_path = str(template.name)
 
-        # If the template matches any of the skip patterns, reload it without cache
+        # If the template matches any of the skip patterns, ensure that the cached copy is still valid
         if any(template_path.startswith(d) for d in skip_cache_dirs):
-            template = BaseLoader.get_template(self, template_name, skip)
+            try:
+                mtime = os.stat(template_path).st_mtime_ns
+            except OSError:
+                mtime = None
+
+            key = self.cache_key(template_name, skip)
+
+            if mtime is None or self.template_mtimes.get(key) != mtime:
+                # Template file has changed (or is not a file) - reload it without cache
+                template = BaseLoader.get_template(self, template_name, skip)
+
+                if mtime is not None:
+                    self.get_template_cache[key] = template
+                    self.template_mtimes[key] = mtime
 
         return template
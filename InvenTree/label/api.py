@@ -1,24 +1,31 @@
 """API functionality for the 'label' app"""
 
+import copy
+import io
+
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import FieldError, ValidationError
-from django.http import HttpResponse, JsonResponse
-from django.urls import include, path, re_path
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.urls import include, path, re_path, reverse
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page, never_cache
 
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import permissions
 from rest_framework.exceptions import NotFound
+from rest_framework.views import APIView
 
 import build.models
 import common.models
-import InvenTree.helpers
 import label.models
 import label.serializers
 from InvenTree.api import MetadataView
 from InvenTree.filters import InvenTreeSearchFilter
+from InvenTree.helpers import str2bool
 from InvenTree.mixins import ListAPI, RetrieveAPI, RetrieveUpdateDestroyAPI
 from InvenTree.tasks import offload_task
+from label.tasks import render_label_pdfs
 from part.models import Part
 from plugin.base.label import label as plugin_label
 from plugin.registry import registry
@@ -95,7 +102,7 @@ class LabelListView(LabelFilterMixin, ListAPI):
                 matches = True
 
                 try:
-                    filters = InvenTree.helpers.validateFilterString(lbl.filters)
+                    filters = lbl.get_filters_dict()
                 except ValidationError:
                     continue
 
@@ -187,39 +194,58 @@ class LabelPrintMixin(LabelFilterMixin):
         # Check the request to determine if the user has selected a label printing plugin
         plugin = self.get_plugin(request)
 
+        # Prefetch any related data required to render the labels
+        items_to_print = self.queryset.model.prepare_queryset(items_to_print)
+
         if len(items_to_print) == 0:
             # No valid items provided, return an error message
 
             raise ValidationError('No valid objects provided to label template')
 
-        outputs = []
-
         # In debug mode, generate single HTML output, rather than PDF
         debug_mode = common.models.InvenTreeSetting.get_setting('REPORT_DEBUG_MODE', cache=False)
 
-        label_name = "label.pdf"
+        if plugin is None and not debug_mode:
+            """Render all labels into a single PDF object, and return the resulting document!"""
+
+            if str2bool(request.query_params.get('async', False)) and label.models.shared_cache_enabled():
+                """Render the PDF file using the background worker, and return a reference to the output.
+
+                This is only possible if the output can be shared (via the cache) between server processes,
+                otherwise the PDF file is rendered and returned immediately.
+                """
+
+                output = self.get_object().render_async(request, items_to_print)
+
+                return JsonResponse({
+                    'output': output,
+                    'url': reverse('api-label-output', kwargs={'output': output}),
+                }, status=202)
+
+            inline = common.models.InvenTreeUserSetting.get_setting('LABEL_INLINE', user=request.user, cache=False)
+
+            return self.get_object().render_batch(request, items_to_print, inline=inline)
+
+        outputs = []
 
         label_names = []
         label_instances = []
 
-        # Merge one or more PDF files into a single download
-        for item in items_to_print:
-            label = self.get_object()
-            label.object_to_print = item
+        label_template = self.get_object()
 
-            label_name = label.generate_filename(request)
+        base_context = label_template.base_context(request)
 
-            label_names.append(label_name)
-            label_instances.append(label)
+        for item in items_to_print:
+            # Each label is printed against a separate copy of the label template instance
+            label_instance = copy.copy(label_template)
+            label_instance.object_to_print = item
 
-            if debug_mode and plugin is None:
-                # Note that debug mode is only supported when not using a plugin
-                outputs.append(label.render_as_string(request))
-            else:
-                outputs.append(label.render(request))
+            context = label_instance.context(request, base_context=base_context)
 
-        if not label_name.endswith(".pdf"):
-            label_name += ".pdf"
+            label_names.append(label_instance.generate_filename(request, context=context))
+            label_instances.append(label_instance)
+
+            outputs.append(label_instance.render_as_string(request, context=context))
 
         if plugin is not None:
             """Label printing is to be handled by a plugin, rather than being exported to PDF.
@@ -231,11 +257,11 @@ class LabelPrintMixin(LabelFilterMixin):
             - Return a JSON response indicating that the printing has been offloaded
             """
 
-            for idx, output in enumerate(outputs):
-                """For each output, we generate a temporary image file, which will then get sent to the printer."""
+            # Generate PDF data for each label (in parallel, if configured)
+            pdfs = render_label_pdfs(outputs, request.build_absolute_uri("/"))
 
-                # Generate PDF data for the label
-                pdf = output.get_document().write_pdf()
+            for idx, pdf in enumerate(pdfs):
+                """For each output, we generate a temporary image file, which will then get sent to the printer."""
 
                 # Offload a background task to print the provided label
                 offload_task(
@@ -252,33 +278,55 @@ class LabelPrintMixin(LabelFilterMixin):
                 'labels': label_names,
             })
 
-        elif debug_mode:
+        else:
             """Contatenate all rendered templates into a single HTML string, and return the string as a HTML response."""
 
             html = "\n".join(outputs)
 
             return HttpResponse(html)
 
-        else:
-            """Concatenate all rendered pages into a single PDF object, and return the resulting document!"""
 
-            pages = []
+class LabelOutputView(APIView):
+    """API endpoint for retrieving a label PDF file which is rendered by the background worker.
 
-            for output in outputs:
-                doc = output.get_document()
-                for page in doc.pages:
-                    pages.append(page)
+    - If the PDF file has been rendered, it is returned as a file download
+    - If the PDF file is still being rendered, a 202 (Accepted) response is returned
+    - The output is only available to the user who requested it
+    """
 
-            pdf = outputs[0].get_document().copy(pages).write_pdf()
+    permission_classes = [
+        permissions.IsAuthenticated,
+    ]
 
-            inline = common.models.InvenTreeUserSetting.get_setting('LABEL_INLINE', user=request.user, cache=False)
+    def get(self, request, output, *args, **kwargs):
+        """Return the rendered PDF file (if available)"""
+        key = f'{label.models.PDF_CACHE_PREFIX}{output}'
 
-            return InvenTree.helpers.DownloadFile(
-                pdf,
-                label_name,
-                content_type='application/pdf',
-                inline=inline
-            )
+        # The filename is stored against the user who requested the output
+        filename = cache.get(f'{key}-{request.user.pk}')
+
+        if filename is None:
+            raise NotFound(f"Label output '{output}' not found")
+
+        pdf = cache.get(key)
+
+        if pdf is None:
+            if cache.get(f'{key}-pending'):
+                return JsonResponse({
+                    'output': output,
+                    'complete': False,
+                }, status=202)
+
+            raise NotFound(f"Label output '{output}' not found")
+
+        inline = common.models.InvenTreeUserSetting.get_setting('LABEL_INLINE', user=request.user, cache=False)
+
+        return FileResponse(
+            io.BytesIO(pdf),
+            as_attachment=not inline,
+            filename=filename,
+            content_type='application/pdf'
+        )
 
 
 class StockItemLabelMixin:
@@ -396,6 +444,9 @@ class BuildLineLabelPrint(BuildLineLabelMixin, LabelPrintMixin, RetrieveAPI):
 
 label_api_urls = [
 
+    # Label output (rendered by the background worker)
+    re_path(r'^output/(?P<output>[0-9a-f]+)/?', LabelOutputView.as_view(), name='api-label-output'),
+
     # Stock item labels
     re_path(r'stock/', include([
         # Detail views
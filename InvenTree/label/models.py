@@ -1,35 +1,54 @@
 """Label printing models."""
 
 import datetime
+import functools
+import hashlib
+import io
 import logging
 import os
-import sys
+import re
+from pathlib import PurePosixPath
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator, MinValueValidator
 from django.db import models
+from django.db.models import prefetch_related_objects
+from django.http import FileResponse
 from django.template import Context, Template
-from django.template.loader import render_to_string
+from django.template.loader import get_template
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 import build.models
+import InvenTree.tasks
 import part.models
 import stock.models
 from InvenTree.helpers import normalize, validateFilterString
 from InvenTree.helpers_model import get_base_url
 from InvenTree.models import MetadataMixin
+from label.render import create_font_config, render_html_document
 from plugin.registry import registry
 
-try:
-    from django_weasyprint import WeasyTemplateResponseMixin
-except OSError as err:  # pragma: no cover
-    print("OSError: {e}".format(e=err))
-    print("You may require some further system packages to be installed.")
-    sys.exit(1)
+logger = logging.getLogger("inventree")
 
+# Rendered label PDF data is cached (against the rendered HTML) for this many seconds (if settings.LABEL_PDF_CACHE is enabled)
+PDF_CACHE_PREFIX = 'label-pdf-'
+PDF_CACHE_TIMEOUT = 3600
 
-logger = logging.getLogger("inventree")
+# Cache backends which are not shared between server processes (and the background worker)
+LOCAL_CACHE_BACKENDS = [
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+]
+
+# Validator for uploaded label template files (shared between all label models)
+HTML_EXTENSION_VALIDATOR = FileExtensionValidator(allowed_extensions=['html'])
+
+# Matches <link> tags which reference bundled (site-wide) stylesheet files
+BUNDLE_LINK_REGEX = re.compile(r'<link[^>]+href="[^"]*\.bundle[^"]*"[^>]*>', re.IGNORECASE)
 
 
 def rename_label(instance, filename):
@@ -39,47 +58,150 @@ def rename_label(instance, filename):
     return os.path.join('label', 'template', instance.SUBDIR, filename)
 
 
+@functools.lru_cache(maxsize=512)
+def compile_filename_pattern(pattern):
+    """Return a compiled template for the provided filename pattern.
+
+    Compiled templates are cached (keyed by the pattern string),
+    so that the pattern is not re-parsed each time a label is printed.
+    """
+    return Template(pattern)
+
+
+@functools.lru_cache(maxsize=1)
+def get_report_plugins(generation):
+    """Return the registered plugins which implement the 'report' mixin.
+
+    The result is cached against the plugin registry generation,
+    so the registry is only scanned again when the registered plugins change.
+    """
+    return tuple(registry.with_mixin('report'))
+
+
+def strip_bundle_links(html):
+    """Remove any links to bundled stylesheets from the provided HTML string.
+
+    Bundled stylesheets are not used for label rendering,
+    but would otherwise be fetched and parsed by WeasyPrint for every label.
+    """
+    return BUNDLE_LINK_REGEX.sub('', html)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_filters(filters, model=None):
+    """Parse (and validate) a label filter string.
+
+    The result is cached for each unique filter string and model,
+    so that the filter string is only parsed once.
+
+    Note: The returned dict is shared between callers, and should not be modified.
+    """
+    return validateFilterString(filters, model=model)
+
+
+def pdf_cache_key(labels, base_url):
+    """Return the cache key for the PDF data rendered from the provided labels.
+
+    The key is a hash of the rendered label HTML (and base URL),
+    so identical labels share the same cached PDF data.
+
+    Arguments:
+        labels: List of rendered label templates (HTML strings)
+        base_url: Base URL used to resolve relative links in the templates
+    """
+    digest = hashlib.blake2b(base_url.encode())
+
+    for html in labels:
+        digest.update(b'\0')
+        digest.update(html.encode())
+
+    return f'{PDF_CACHE_PREFIX}{digest.hexdigest()}'
+
+
+def shared_cache_enabled():
+    """Return True if the default cache backend is shared between processes.
+
+    Labels can only be rendered by the background worker if the rendered output
+    can be retrieved (from the cache) by any of the web server processes.
+    """
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def render_pdf_data(labels, base_url):
+    """Render one or more labels to a single PDF file, using WeasyPrint.
+
+    Arguments:
+        labels: List of rendered label templates (HTML strings)
+        base_url: Base URL used to resolve relative links in the templates
+
+    Returns:
+        Binary PDF data
+    """
+    # The font configuration is shared between all labels in this batch
+    font_config = create_font_config()
+
+    documents = [render_html_document(html, base_url, font_config=font_config) for html in labels]
+    pages = [page for document in documents for page in document.pages]
+
+    return documents[0].copy(pages).write_pdf()
+
+
+def render_pdf(labels, base_url):
+    """Render one or more labels to a single PDF file.
+
+    If settings.LABEL_PDF_CACHE is enabled, and the same labels have been rendered recently,
+    the cached PDF data is returned and WeasyPrint is bypassed entirely.
+
+    Arguments:
+        labels: List of rendered label templates (HTML strings)
+        base_url: Base URL used to resolve relative links in the templates
+
+    Returns:
+        Binary PDF data
+    """
+    if not settings.LABEL_PDF_CACHE:
+        return render_pdf_data(labels, base_url)
+
+    key = pdf_cache_key(labels, base_url)
+
+    pdf = cache.get(key)
+
+    if pdf is None:
+        pdf = render_pdf_data(labels, base_url)
+
+        cache.set(key, pdf, PDF_CACHE_TIMEOUT)
+
+    return pdf
+
+
 def validate_stock_item_filters(filters):
     """Validate query filters for the StockItemLabel model"""
-    filters = validateFilterString(filters, model=stock.models.StockItem)
+    filters = dict(parse_filters(filters, stock.models.StockItem))
 
     return filters
 
 
 def validate_stock_location_filters(filters):
     """Validate query filters for the StockLocationLabel model"""
-    filters = validateFilterString(filters, model=stock.models.StockLocation)
+    filters = dict(parse_filters(filters, stock.models.StockLocation))
 
     return filters
 
 
 def validate_part_filters(filters):
     """Validate query filters for the PartLabel model"""
-    filters = validateFilterString(filters, model=part.models.Part)
+    filters = dict(parse_filters(filters, part.models.Part))
 
     return filters
 
 
 def validate_build_line_filters(filters):
     """Validate query filters for the BuildLine model"""
-    filters = validateFilterString(filters, model=build.models.BuildLine)
+    filters = dict(parse_filters(filters, build.models.BuildLine))
 
     return filters
 
 
-class WeasyprintLabelMixin(WeasyTemplateResponseMixin):
-    """Class for rendering a label to a PDF."""
-
-    pdf_filename = 'label.pdf'
-    pdf_attachment = True
-
-    def __init__(self, request, template, **kwargs):
-        """Initialize a label mixin with certain properties"""
-        self.request = request
-        self.template_name = template
-        self.pdf_filename = kwargs.get('filename', 'label.pdf')
-
-
 class LabelTemplate(MetadataMixin, models.Model):
     """Base class for generic, filterable labels."""
 
@@ -92,13 +214,36 @@ class LabelTemplate(MetadataMixin, models.Model):
     SUBDIR = "label"
 
     # Object we will be printing against (will be filled out later)
-    object_to_print = None
+    _object_to_print = None
+
+    @property
+    def object_to_print(self):
+        """Return the object which this label is being printed against"""
+        return self._object_to_print
+
+    @object_to_print.setter
+    def object_to_print(self, obj):
+        """Set the object which this label is being printed against.
+
+        Any related data required to render the label is loaded at this point
+        """
+        if obj is not None:
+            obj = self.prepare_object(obj)
+
+        self._object_to_print = obj
 
     @property
     def template(self):
         """Return the file path of the template associated with this label instance"""
         return self.label.path
 
+    def save(self, *args, **kwargs):
+        """Save the label template, and discard any cached data derived from the template file"""
+        super().save(*args, **kwargs)
+
+        # The template file may have changed
+        self.__dict__.pop('template_name', None)
+
     def __str__(self):
         """Format a string representation of a label instance"""
         return "{n} - {d}".format(
@@ -125,7 +270,7 @@ class LabelTemplate(MetadataMixin, models.Model):
         blank=False, null=False,
         verbose_name=_('Label'),
         help_text=_('Label template file'),
-        validators=[FileExtensionValidator(allowed_extensions=['html'])],
+        validators=[HTML_EXTENSION_VALIDATOR],
     )
 
     enabled = models.BooleanField(
@@ -155,19 +300,60 @@ class LabelTemplate(MetadataMixin, models.Model):
         max_length=100,
     )
 
-    @property
+    @cached_property
     def template_name(self):
         """Returns the file system path to the template file.
 
         Required for passing the file to an external process
         """
-        template = self.label.name
-        template = template.replace('/', os.path.sep)
-        template = template.replace('\\', os.path.sep)
+        return settings.MEDIA_ROOT / PurePosixPath(self.label.name.replace('\\', '/'))
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        """Prepare a queryset of objects to be printed against this label template.
+
+        Override this in any subclass, to prefetch related data which is required to render the label.
+        This prevents additional database queries being made for each label when printing multiple labels.
+        """
+        return queryset
+
+    def prepare_object(self, obj):
+        """Prepare a single object to be printed against this label template.
+
+        Override this in any subclass, to ensure that related data required to render the label is loaded.
+        Data which has already been fetched (e.g. via prepare_queryset) is not fetched again.
+        """
+        return obj
+
+    def get_request_data(self, request, key, func):
+        """Return data which is shared between all labels printed within a single request.
+
+        The data is computed (by calling func) the first time the key is requested,
+        e.g. so that the parameters for a Part are only looked up once when printing labels for multiple stock items of that Part.
+
+        Arguments:
+            request: The request object which triggered the label print
+            key: Unique (hashable) key for the data
+            func: Function which computes the data
+        """
+        data = getattr(request, '_label_data', None)
+
+        if data is None:
+            data = {}
+            request._label_data = data
 
-        template = settings.MEDIA_ROOT.joinpath(template)
+        if key not in data:
+            data[key] = func()
 
-        return template
+        return data[key]
+
+    def get_filters_dict(self):
+        """Return the query filters for this label, as a dict of key:value pairs.
+
+        Raises:
+            ValidationError: If the filter string is invalid
+        """
+        return dict(parse_filters(self.filters))
 
     def get_context_data(self, request):
         """Supply custom context data to the template for rendering.
@@ -176,31 +362,57 @@ class LabelTemplate(MetadataMixin, models.Model):
         """
         return {}  # pragma: no cover
 
-    def generate_filename(self, request, **kwargs):
-        """Generate a filename for this label."""
-        template_string = Template(self.filename_pattern)
+    def generate_filename(self, request, *, context=None, **kwargs):
+        """Generate a filename for this label.
+
+        Arguments:
+            request: The request object which triggered the label print
+            context: Optional pre-computed label context (will be generated if not provided)
+        """
+        template_string = compile_filename_pattern(self.filename_pattern)
 
-        ctx = self.context(request)
+        if context is None:
+            context = self.context(request)
 
-        context = Context(ctx)
+        context = Context(context)
 
         return template_string.render(context)
 
-    def context(self, request):
-        """Provides context data to the template."""
+    def base_context(self, request):
+        """Return the "basic" context data which gets passed to every label.
+
+        This data does not depend on the object being printed,
+        and so can be generated once when printing multiple labels.
+        """
+        now = datetime.datetime.now()
+
+        return {
+            'base_url': get_base_url(request=request),
+            'date': now.date(),
+            'datetime': now,
+            'request': request,
+            'user': request.user,
+            'width': self.width,
+            'height': self.height,
+        }
+
+    def context(self, request, base_context=None):
+        """Provides context data to the template.
+
+        Arguments:
+            request: The request object which triggered the label print
+            base_context: Optional pre-computed "basic" context data (will be generated if not provided)
+        """
         context = self.get_context_data(request)
 
+        if base_context is None:
+            base_context = self.base_context(request)
+
         # Add "basic" context data which gets passed to every label
-        context['base_url'] = get_base_url(request=request)
-        context['date'] = datetime.datetime.now().date()
-        context['datetime'] = datetime.datetime.now()
-        context['request'] = request
-        context['user'] = request.user
-        context['width'] = self.width
-        context['height'] = self.height
+        context.update(base_context)
 
         # Pass the context through to any registered plugins
-        plugins = registry.with_mixin('report')
+        plugins = get_report_plugins(registry.generation)
 
         for plugin in plugins:
             # Let each plugin add its own context data
@@ -208,30 +420,145 @@ class LabelTemplate(MetadataMixin, models.Model):
 
         return context
 
-    def render_as_string(self, request, **kwargs):
+    def render_as_string(self, request, context=None, **kwargs):
         """Render the label to a HTML string.
 
         Useful for debug mode (viewing generated code)
+
+        Arguments:
+            request: The request object which triggered the label print
+            context: Optional pre-computed label context (will be generated if not provided)
+        """
+        if context is None:
+            context = self.context(request)
+
+        # The compiled template is cached by the template loader (and revalidated against the file modification time)
+        html = get_template(str(self.template_name)).render(context, request)
+
+        return strip_bundle_links(html)
+
+    def render_document(self, request, context=None, **kwargs):
+        """Render the label template to a WeasyPrint document.
+
+        Arguments:
+            request: The request object which triggered the label print
+            context: Optional pre-computed label context (will be generated if not provided)
+        """
+        return render_html_document(
+            self.render_as_string(request, context=context),
+            request.build_absolute_uri("/"),
+        )
+
+    def render_labels(self, request, objects):
+        """Render this label template against multiple objects, to HTML.
+
+        Arguments:
+            request: The request object which triggered the label print
+            objects: List of objects to print labels against
+
+        Returns:
+            A tuple of (labels, filename), where labels is a list of rendered HTML strings,
+            and the filename is generated from the context of the last label
+
+        Raises:
+            ValidationError: If no objects are provided
+        """
+        if len(objects) == 0:
+            raise ValidationError(_('No objects provided to label template'))
+
+        labels = []
+
+        base_context = self.base_context(request)
+
+        for obj in objects:
+            self.object_to_print = obj
+
+            context = self.context(request, base_context=base_context)
+
+            labels.append(self.render_as_string(request, context=context))
+
+        filename = self.generate_filename(request, context=context)
+
+        if not filename.endswith(".pdf"):
+            filename += ".pdf"
+
+        return labels, filename
+
+    def render_batch(self, request, objects, inline=False, **kwargs):
+        """Render this label template against multiple objects, as a single PDF file.
+
+        Each object is rendered using the shared font configuration,
+        and the resulting pages are combined so that the PDF file is only written once.
+
+        Arguments:
+            request: The request object which triggered the label print
+            objects: List of objects to print labels against
+            inline: Download the PDF file "inline" or as attachment? (Default = attachment)
+
+        Returns:
+            A FileResponse object containing the pages for all labels (as a single PDF file)
         """
-        return render_to_string(self.template_name, self.context(request), request)
+        labels, filename = self.render_labels(request, objects)
+
+        pdf = render_pdf(labels, request.build_absolute_uri("/"))
+
+        return FileResponse(
+            io.BytesIO(pdf),
+            as_attachment=not inline,
+            filename=filename,
+            content_type='application/pdf'
+        )
+
+    def render_async(self, request, objects, **kwargs):
+        """Render this label template against multiple objects, as a single PDF file, using the background worker.
+
+        The label templates are rendered to HTML immediately, and the PDF file is rendered by the background worker.
+        The rendered PDF file is stored in the cache, where identical requests will share the same output.
+
+        Note: This requires a shared cache backend (see shared_cache_enabled)
+
+        Arguments:
+            request: The request object which triggered the label print
+            objects: List of objects to print labels against
+
+        Returns:
+            The output reference, which can be used to retrieve the rendered PDF file via the API
+        """
+        from label import tasks as label_tasks
+
+        labels, filename = self.render_labels(request, objects)
+
+        base_url = request.build_absolute_uri("/")
+
+        key = pdf_cache_key(labels, base_url)
+
+        # The output can only be retrieved by the requesting user (identical requests from other users share the PDF data)
+        cache.set(f'{key}-{request.user.pk}', filename, PDF_CACHE_TIMEOUT)
+
+        # Only offload a new task if the PDF file is not already rendered (or being rendered)
+        if cache.get(key) is None and cache.add(f'{key}-pending', True, settings.Q_CLUSTER['timeout']):
+            InvenTree.tasks.offload_task(label_tasks.render_labels_task, labels, base_url)
+
+        return key[len(PDF_CACHE_PREFIX):]
 
     def render(self, request, **kwargs):
         """Render the label template to a PDF file.
 
-        Uses django-weasyprint plugin to render HTML template
+        Uses WeasyPrint to render the HTML template
         """
-        wp = WeasyprintLabelMixin(
-            request,
-            self.template_name,
-            base_url=request.build_absolute_uri("/"),
-            presentational_hints=True,
-            filename=self.generate_filename(request),
-            **kwargs
+        # Generate the context data once, and use it for both the filename and the label itself
+        context = self.context(request)
+
+        pdf = render_pdf(
+            [self.render_as_string(request, context=context)],
+            request.build_absolute_uri("/"),
         )
 
-        return wp.render_to_response(
-            self.context(request),
-            **kwargs
+        return FileResponse(
+            io.BytesIO(pdf),
+            as_attachment=True,
+            filename=self.generate_filename(request, context=context),
+            content_type='application/pdf'
         )
 
 
@@ -254,24 +581,36 @@ class StockItemLabel(LabelTemplate):
         ]
     )
 
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        """Prefetch the Part (and part parameter) data for each StockItem"""
+        return queryset.select_related('part').prefetch_related('part__parameters__template')
+
+    def prepare_object(self, obj):
+        """Ensure that the Part (and part parameter) data is loaded for the StockItem"""
+        prefetch_related_objects([obj], 'part__parameters__template')
+
+        return obj
+
     def get_context_data(self, request):
         """Generate context data for each provided StockItem."""
         stock_item = self.object_to_print
+        part = stock_item.part
 
         return {
             'item': stock_item,
-            'part': stock_item.part,
-            'name': stock_item.part.full_name,
-            'ipn': stock_item.part.IPN,
-            'revision': stock_item.part.revision,
+            'part': part,
+            'name': part.full_name,
+            'ipn': part.IPN,
+            'revision': part.revision,
             'quantity': normalize(stock_item.quantity),
             'serial': stock_item.serial,
             'barcode_data': stock_item.barcode_data,
             'barcode_hash': stock_item.barcode_hash,
             'qr_data': stock_item.format_barcode(brief=True),
             'qr_url': request.build_absolute_uri(stock_item.get_absolute_url()),
-            'tests': stock_item.testResultMap(),
-            'parameters': stock_item.part.parameters_map(),
+            'tests': self.get_request_data(request, ('tests', stock_item.pk), stock_item.testResultMap),
+            'parameters': self.get_request_data(request, ('parameters', part.pk), part.parameters_map),
 
         }
 
@@ -323,6 +662,17 @@ class PartLabel(LabelTemplate):
         ]
     )
 
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        """Prefetch the category and parameter data for each Part"""
+        return queryset.select_related('category').prefetch_related('parameters__template')
+
+    def prepare_object(self, obj):
+        """Ensure that the category and parameter data is loaded for the Part"""
+        prefetch_related_objects([obj], 'category', 'parameters__template')
+
+        return obj
+
     def get_context_data(self, request):
         """Generate context data for each provided Part object."""
         part = self.object_to_print
@@ -336,7 +686,7 @@ class PartLabel(LabelTemplate):
             'revision': part.revision,
             'qr_data': part.format_barcode(brief=True),
             'qr_url': request.build_absolute_uri(part.get_absolute_url()),
-            'parameters': part.parameters_map(),
+            'parameters': self.get_request_data(request, ('parameters', part.pk), part.parameters_map),
         }
 
 
@@ -359,16 +709,28 @@ class BuildLineLabel(LabelTemplate):
         ]
     )
 
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        """Prefetch the Build and BomItem data for each BuildLine"""
+        return queryset.select_related('build', 'bom_item', 'bom_item__sub_part')
+
+    def prepare_object(self, obj):
+        """Ensure that the Build and BomItem data is loaded for the BuildLine"""
+        prefetch_related_objects([obj], 'build', 'bom_item__sub_part')
+
+        return obj
+
     def get_context_data(self, request):
         """Generate context data for each provided BuildLine object."""
 
         build_line = self.object_to_print
+        bom_item = build_line.bom_item
 
         return {
             'build_line': build_line,
             'build': build_line.build,
-            'bom_item': build_line.bom_item,
-            'part': build_line.bom_item.sub_part,
+            'bom_item': bom_item,
+            'part': bom_item.sub_part,
             'quantity': build_line.quantity,
             'allocated_quantity': build_line.allocated_quantity,
             'allocations': build_line.allocations,
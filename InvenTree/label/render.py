@@ -0,0 +1,59 @@
+"""Functions for rendering label templates to PDF, using WeasyPrint.
+
+Note: This module must not import any Django models (or settings),
+as the functions are also run in the label rendering worker processes (see label.tasks)
+"""
+
+import logging
+
+logger = logging.getLogger("inventree")
+
+
+def create_font_config():
+    """Create a font configuration, to be shared between the labels rendered in a single batch.
+
+    Note: A font configuration must not be shared between threads, or between batches
+    (any @font-face rules in a template are added to the configuration, and never removed)
+    """
+    from weasyprint.text.fonts import FontConfiguration
+
+    return FontConfiguration()
+
+
+def render_html_document(html, base_url, font_config=None):
+    """Render a HTML string to a WeasyPrint document.
+
+    WeasyPrint (and the system libraries it depends on) is imported here,
+    rather than when the server starts, so that processes which never render a label do not load it.
+
+    Arguments:
+        html: The rendered label template (HTML string)
+        base_url: Base URL used to resolve relative links in the template
+        font_config: Font configuration shared between labels in the same batch (a new one is created if not provided)
+    """
+    try:
+        import weasyprint
+    except OSError as err:  # pragma: no cover
+        logger.error(f"Could not load WeasyPrint - you may require some further system packages to be installed: {err}")
+        raise
+
+    document = weasyprint.HTML(
+        string=html,
+        base_url=base_url,
+    )
+
+    if font_config is None:
+        font_config = create_font_config()
+
+    return document.render(
+        font_config=font_config,
+        presentational_hints=True,
+    )
+
+
+def render_label_pdf(html, base_url, font_config=None):
+    """Render a single label (provided as a HTML string) to PDF data.
+
+    Note: This function may be run in a worker process, and so must not access the database.
+    """
+    return render_html_document(html, base_url, font_config=font_config).write_pdf()
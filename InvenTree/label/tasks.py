@@ -0,0 +1,111 @@
+"""Background tasks for the 'label' app"""
+
+import itertools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import cache
+
+from label.models import PDF_CACHE_TIMEOUT, pdf_cache_key, render_pdf_data
+from label.render import create_font_config, render_label_pdf
+
+logger = logging.getLogger('inventree')
+
+# Pool of worker processes used for rendering labels (created on first use)
+render_pool = None
+render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """Return the process pool used for rendering labels in parallel.
+
+    Worker processes are started with the 'spawn' method (rather than forked from a multi-threaded server process),
+    and only import the label.render module, which does not depend on Django.
+
+    Note: A separate pool is created in each web server process which renders labels
+    """
+    global render_pool
+
+    with render_pool_lock:
+        if render_pool is None:
+            render_pool = ProcessPoolExecutor(
+                max_workers=settings.LABEL_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+
+        return render_pool
+
+
+def reset_render_pool():
+    """Discard the process pool used for rendering labels (e.g. if a worker process has failed)."""
+    global render_pool
+
+    with render_pool_lock:
+        render_pool = None
+
+
+def render_label_pdfs(labels, base_url):
+    """Render multiple labels (provided as HTML strings) to PDF data.
+
+    If settings.LABEL_PDF_CACHE is enabled, any labels which have been rendered recently are retrieved from the PDF cache.
+
+    If settings.LABEL_RENDER_WORKERS is greater than one,
+    the remaining labels are rendered in parallel across a pool of worker processes.
+
+    Arguments:
+        labels: List of rendered label templates (HTML strings)
+        base_url: Base URL used to resolve relative links in the templates
+
+    Returns:
+        A list of PDF data, in the same order as the provided labels
+    """
+    keys = [pdf_cache_key([html], base_url) for html in labels]
+
+    pdfs = cache.get_many(keys) if settings.LABEL_PDF_CACHE else {}
+
+    # Labels which are not already cached must be rendered
+    missing = {key: html for key, html in zip(keys, labels) if key not in pdfs}
+
+    rendered = None
+
+    if settings.LABEL_RENDER_WORKERS > 1 and len(missing) > 1:
+        try:
+            rendered = list(get_render_pool().map(render_label_pdf, missing.values(), itertools.repeat(base_url)))
+        except BrokenProcessPool:
+            logger.error("Label rendering pool failed - rendering labels in the server process")
+            reset_render_pool()
+
+    if rendered is None:
+        # The font configuration is shared between all labels in this batch
+        font_config = create_font_config() if missing else None
+
+        rendered = [render_label_pdf(html, base_url, font_config=font_config) for html in missing.values()]
+
+    rendered = dict(zip(missing.keys(), rendered))
+
+    if settings.LABEL_PDF_CACHE:
+        cache.set_many(rendered, PDF_CACHE_TIMEOUT)
+
+    pdfs.update(rendered)
+
+    return [pdfs[key] for key in keys]
+
+
+def render_labels_task(labels, base_url):
+    """Render multiple labels (provided as HTML strings) to a single PDF file.
+
+    This task is nominally handled by the background worker.
+    The rendered PDF data is stored in the cache, from where it can be retrieved via the API.
+    """
+    key = pdf_cache_key(labels, base_url)
+
+    try:
+        # The output is always stored in the cache, as this is how it is returned to the user
+        cache.set(key, render_pdf_data(labels, base_url), PDF_CACHE_TIMEOUT)
+    finally:
+        # Clear the 'pending' flag, even if rendering failed
+        cache.delete(f'{key}-pending')
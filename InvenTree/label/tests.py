@@ -1,11 +1,20 @@
 """Tests for labels"""
 
 import io
+import os
+import re
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
 
 from django.apps import apps
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from common.models import InvenTreeSetting
@@ -14,7 +23,10 @@ from InvenTree.unit_test import InvenTreeAPITestCase
 from part.models import Part
 from stock.models import StockItem
 
-from .models import PartLabel, StockItemLabel, StockLocationLabel
+from . import tasks as label_tasks
+from .models import (PDF_CACHE_PREFIX, PartLabel, StockItemLabel,
+                     StockLocationLabel, compile_filename_pattern,
+                     parse_filters, pdf_cache_key, strip_bundle_links)
 
 
 class LabelTest(InvenTreeAPITestCase):
@@ -70,6 +82,42 @@ class LabelTest(InvenTreeAPITestCase):
         with self.assertRaises(ValidationError):
             validateFilterString(bad_filter_string, model=StockItem)
 
+        # Parsed filters are cached for each unique filter string and model
+        self.assertEqual(parse_filters(filter_string, StockItem), {'part__pk': '10'})
+        self.assertIs(parse_filters(filter_string, StockItem), parse_filters(filter_string, StockItem))
+
+        with self.assertRaises(ValidationError):
+            parse_filters(bad_filter_string, StockItem)
+
+    def test_filename_pattern(self):
+        """Test that compiled filename patterns are cached."""
+        pattern = "label_{{ part.pk }}.pdf"
+
+        self.assertIs(compile_filename_pattern(pattern), compile_filename_pattern(pattern))
+        self.assertIsNot(compile_filename_pattern(pattern), compile_filename_pattern("label.pdf"))
+
+    def test_strip_bundle_links(self):
+        """Test that links to bundled stylesheets are removed before rendering."""
+        html = '''<head>
+        <link rel="stylesheet" href="/static/css/main.bundle.css">
+        <link rel="stylesheet" href="/static/css/label.css">
+        </head>'''
+
+        html = strip_bundle_links(html)
+
+        self.assertNotIn('main.bundle.css', html)
+        self.assertIn('label.css', html)
+
+    def test_pdf_cache_key(self):
+        """Test that rendered PDF data is cached against the label content."""
+        base_url = 'http://testserver/'
+
+        key = pdf_cache_key(['<p>A</p>', '<p>B</p>'], base_url)
+
+        self.assertEqual(key, pdf_cache_key(['<p>A</p>', '<p>B</p>'], base_url))
+        self.assertNotEqual(key, pdf_cache_key(['<p>A</p><p>B</p>'], base_url))
+        self.assertNotEqual(key, pdf_cache_key(['<p>A</p>', '<p>B</p>'], 'http://localhost/'))
+
     def test_label_rendering(self):
         """Test label rendering."""
         labels = PartLabel.objects.all()
@@ -79,6 +127,127 @@ class LabelTest(InvenTreeAPITestCase):
             url = reverse('api-part-label-print', kwargs={'pk': label.pk})
             self.get(f'{url}?parts={part.pk}', expected_code=200)
 
+    def test_label_rendering_batch(self):
+        """Test that multiple labels are rendered into a single PDF document."""
+        label = PartLabel.objects.first()
+        parts = Part.objects.all()[:3]
+
+        url = reverse('api-part-label-print', kwargs={'pk': label.pk})
+        query = '&'.join([f'parts={part.pk}' for part in parts])
+
+        response = self.get(f'{url}?{query}', expected_code=200)
+
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_label_rendering_empty(self):
+        """Test that rendering a label against no objects raises an error."""
+        label = PartLabel.objects.first()
+
+        # The objects are checked before the request is used
+        with self.assertRaises(ValidationError):
+            label.render_labels(None, [])
+
+    def pdf_page_widths(self, pdf):
+        """Return the width (in pt) of each page in the provided PDF data."""
+        return [float(width) for width in re.findall(rb'/MediaBox\s*\[\s*[\d.]+\s+[\d.]+\s+([\d.]+)', pdf)]
+
+    def test_render_label_pdfs(self):
+        """Test that labels rendered in parallel are returned in the correct order."""
+        # Each label has a different page width, so that the order of the output can be checked
+        widths = [30, 60, 90, 120]
+        labels = [f'<html><style>@page {{ size: {width}pt 20pt; margin: 0; }}</style>{width}</html>' for width in widths]
+
+        base_url = 'http://testserver/'
+
+        with self.settings(LABEL_RENDER_WORKERS=2, LABEL_PDF_CACHE=False):
+            try:
+                pdfs = label_tasks.render_label_pdfs(labels, base_url)
+
+                # The labels were rendered by the worker pool
+                self.assertIsNotNone(label_tasks.render_pool)
+            finally:
+                if label_tasks.render_pool is not None:
+                    label_tasks.render_pool.shutdown()
+
+                label_tasks.reset_render_pool()
+
+            self.assertEqual(len(pdfs), len(labels))
+
+            for width, pdf in zip(widths, pdfs):
+                self.assertTrue(pdf.startswith(b'%PDF'))
+                self.assertEqual(len(self.pdf_page_widths(pdf)), 1)
+                self.assertAlmostEqual(self.pdf_page_widths(pdf)[0], width, places=2)
+
+            # If the worker pool fails, the labels are rendered in the server process instead
+            with mock.patch('label.tasks.get_render_pool') as get_render_pool:
+                get_render_pool.return_value.map.side_effect = BrokenProcessPool()
+
+                pdfs = label_tasks.render_label_pdfs(labels, base_url)
+
+            self.assertIsNone(label_tasks.render_pool)
+
+            for width, pdf in zip(widths, pdfs):
+                self.assertAlmostEqual(self.pdf_page_widths(pdf)[0], width, places=2)
+
+    def test_label_rendering_async(self):
+        """Test that labels can be rendered by the background worker."""
+        label = PartLabel.objects.first()
+        part = Part.objects.first()
+
+        url = reverse('api-part-label-print', kwargs={'pk': label.pk})
+
+        # The default (in-memory) cache is not shared, so the PDF file is returned immediately
+        response = self.get(f'{url}?parts={part.pk}&async=true', expected_code=200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            caches = {
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': cache_dir,
+                },
+            }
+
+            with self.settings(CACHES=caches):
+                response = self.get(f'{url}?parts={part.pk}&async=true', expected_code=202)
+
+                output = response.json()['output']
+                output_url = reverse('api-label-output', kwargs={'output': output})
+                self.assertEqual(response.json()['url'], output_url)
+
+                # Background worker is not running, so the output has been rendered already
+                response = self.get(output_url, expected_code=200)
+                self.assertEqual(response['Content-Type'], 'application/pdf')
+
+                # Unknown output reference
+                self.get(reverse('api-label-output', kwargs={'output': 'abc123'}), expected_code=404)
+
+                # Output which is still being rendered by the background worker
+                key = f'{PDF_CACHE_PREFIX}abc123'
+                cache.set(f'{key}-{self.user.pk}', 'label.pdf')
+                cache.set(f'{key}-pending', True)
+
+                pending_url = reverse('api-label-output', kwargs={'output': 'abc123'})
+
+                response = self.get(pending_url, expected_code=202)
+                self.assertFalse(response.json()['complete'])
+
+                # Rendering fails, and the pending flag is cleared
+                with mock.patch('label.tasks.pdf_cache_key', return_value=key):
+                    with mock.patch('label.tasks.render_pdf_data', side_effect=OSError):
+                        with self.assertRaises(OSError):
+                            label_tasks.render_labels_task(['<html></html>'], 'http://testserver/')
+
+                self.assertIsNone(cache.get(f'{key}-pending'))
+                self.assertIsNone(cache.get(key))
+
+                self.get(pending_url, expected_code=404)
+
+                # The output is not available to any other user
+                other_user = get_user_model().objects.create_user('other', 'other@inventree.org', 'password')
+                self.client.force_login(other_user)
+                self.get(output_url, expected_code=404)
+
     def test_print_part_label(self):
         """Actually 'print' a label, and ensure that the correct information is contained."""
 
@@ -131,6 +300,110 @@ class LabelTest(InvenTreeAPITestCase):
         self.assertIn("image: /static/img/blank_image.png", content)
         self.assertIn("logo: /static/img/inventree.png", content)
 
+    def test_template_reload(self):
+        """Test that changes to a label template file are rendered, even though the template is cached."""
+        label = PartLabel.objects.create(
+            name='reload',
+            description='Test label reload',
+            enabled=True,
+            label=ContentFile("<html>name: {{ part.name }}</html>", "reload.html"),
+        )
+
+        InvenTreeSetting.set_setting('REPORT_ENABLE', True, None)
+        InvenTreeSetting.set_setting('REPORT_DEBUG_MODE', True, None)
+
+        url = reverse('api-part-label-print', kwargs={'pk': label.pk})
+
+        response = self.get(f'{url}?parts=1', expected_code=200)
+        self.assertIn("name: M2x4 LPHS", str(response.content))
+
+        # Printing again uses the cached template
+        response = self.get(f'{url}?parts=1', expected_code=200)
+        self.assertIn("name: M2x4 LPHS", str(response.content))
+
+        # Overwrite the template file (ensuring that the modification time changes)
+        mtime = os.stat(label.template_name).st_mtime_ns
+
+        with open(label.template_name, 'w', encoding='utf-8') as template_file:
+            template_file.write("<html>pk: {{ part.pk }}</html>")
+
+        os.utime(label.template_name, ns=(mtime + 1_000_000_000, mtime + 1_000_000_000))
+
+        response = self.get(f'{url}?parts=1', expected_code=200)
+        content = str(response.content)
+
+        self.assertIn("pk: 1", content)
+        self.assertNotIn("name: M2x4 LPHS", content)
+
+    def print_query_count(self, url):
+        """Return the number of database queries made when printing labels via the provided URL."""
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url, expected_code=200)
+
+        return len(queries)
+
+    def test_print_query_count(self):
+        """Test that the number of database queries does not grow with the number of labels printed."""
+        InvenTreeSetting.set_setting('REPORT_ENABLE', True, None)
+        InvenTreeSetting.set_setting('REPORT_DEBUG_MODE', True, None)
+
+        part_label = PartLabel.objects.create(
+            name='queries',
+            description='Test part label queries',
+            label=ContentFile("<html>{{ part.pk }} {{ category.name }} {{ parameters }}</html>", "queries.html"),
+        )
+
+        item_label = StockItemLabel.objects.create(
+            name='queries',
+            description='Test stock item label queries',
+            label=ContentFile("<html>{{ item.pk }} {{ part.name }} {{ parameters }} {{ tests }}</html>", "queries.html"),
+        )
+
+        parts = list(Part.objects.values_list('pk', flat=True)[:5])
+        items = list(StockItem.objects.values_list('pk', flat=True)[:5])
+
+        self.assertEqual(len(parts), 5)
+        self.assertEqual(len(items), 5)
+
+        part_url = reverse('api-part-label-print', kwargs={'pk': part_label.pk})
+        item_url = reverse('api-stockitem-label-print', kwargs={'pk': item_label.pk})
+
+        # Print once, so that any cached data (e.g. settings, user roles) is loaded
+        self.print_query_count(f'{part_url}?parts={parts[0]}')
+        self.print_query_count(f'{item_url}?items={items[0]}')
+
+        # Part labels: related data is prefetched for all parts at once
+        n_single = self.print_query_count(f'{part_url}?parts={parts[0]}')
+        n_multiple = self.print_query_count(f'{part_url}?' + '&'.join(f'parts={pk}' for pk in parts))
+
+        self.assertEqual(n_single, n_multiple)
+
+        # Stock item labels: test results are looked up for each stock item (the only per-item query)
+        n_single = self.print_query_count(f'{item_url}?items={items[0]}')
+        n_multiple = self.print_query_count(f'{item_url}?' + '&'.join(f'items={pk}' for pk in items))
+
+        self.assertEqual(n_multiple, n_single + len(items) - 1)
+
+    def test_prepare_object_queries(self):
+        """Test that setting the object to print does not query the database for a prepared queryset."""
+        for label_class, model in [(PartLabel, Part), (StockItemLabel, StockItem)]:
+            label = label_class.objects.first()
+
+            objects = list(label_class.prepare_queryset(model.objects.all()[:5]))
+
+            with self.assertNumQueries(0):
+                for obj in objects:
+                    label.object_to_print = obj
+
+                    self.assertIs(label.object_to_print, obj)
+
+            # An object which has not been prepared has its related data loaded on assignment
+            label.object_to_print = model.objects.first()
+
+            with self.assertNumQueries(0):
+                part = label.object_to_print if model is Part else label.object_to_print.part
+                part.parameters_map()
+
     def test_metadata(self):
         """Unit tests for the metadata field."""
         for model in [StockItemLabel, StockLocationLabel, PartLabel]:
@@ -64,6 +64,8 @@ class PluginsRegistry:
 
         self.installed_apps = []                                # Holds all added plugin_paths
 
+        self.generation = 0                                     # Incremented whenever the registered plugins change
+
     def get_plugin(self, slug):
         """Lookup plugin by slug (unique key)."""
         if slug not in self.plugins:
@@ -398,6 +400,7 @@ class PluginsRegistry:
                     plugin.db.save(no_reload=True)
                 self.plugins_inactive[key] = plugin.db
             self.plugins_full[key] = plugin
+            self.generation += 1
 
         logger.debug('Starting plugin initialisation')
 
@@ -563,6 +566,7 @@ class PluginsRegistry:
         self.plugins: Dict[str, InvenTreePlugin] = {}
         self.plugins_inactive: Dict[str, InvenTreePlugin] = {}
         self.plugins_full: Dict[str, InvenTreePlugin] = {}
+        self.generation += 1
 
     def _update_urls(self):
         from InvenTree.urls import frontendpatterns as urlpattern
@@ -11,6 +11,7 @@ from unittest import mock
 from django.test import TestCase, override_settings
 
 import plugin.templatetags.plugin_extras as plugin_tags
+from label.models import get_report_plugins
 from plugin import InvenTreePlugin, registry
 from plugin.samples.integration.another_sample import (NoIntegrationPlugin,
                                                        WrongIntegrationPlugin)
@@ -245,6 +246,25 @@ class RegistryTests(TestCase):
             # Run tests
             self.run_package_test(str(new_dir))
 
+    def test_registry_generation(self):
+        """Test that cached plugin lookups are refreshed when the plugins are reloaded."""
+        generation = registry.generation
+        get_report_plugins(registry.generation)
+
+        # Lookup is cached for the current generation
+        misses = get_report_plugins.cache_info().misses
+        get_report_plugins(registry.generation)
+        self.assertEqual(get_report_plugins.cache_info().misses, misses)
+
+        registry.reload_plugins()
+
+        self.assertGreater(registry.generation, generation)
+
+        # A fresh lookup is performed for the new generation
+        plugins = get_report_plugins(registry.generation)
+        self.assertEqual(get_report_plugins.cache_info().misses, misses + 1)
+        self.assertEqual(plugins, tuple(registry.with_mixin('report')))
+
     @override_settings(PLUGIN_TESTING_SETUP=True)
     def test_package_loading(self):
         """Test that package distributed plugins work."""
@@ -2032,7 +2032,7 @@ class StockItem(InvenTreeBarcodeMixin, InvenTreeNotesMixin, MetadataMixin, commo
         for lbl in label.models.StockItemLabel.objects.filter(enabled=True):
 
             try:
-                filters = InvenTree.helpers.validateFilterString(lbl.filters)
+                filters = lbl.get_filters_dict()
 
                 if item_query.filter(**filters).exists():
                     labels.append(lbl)